@@ -3,6 +3,11 @@
 
 import os
 import io
+import atexit
+import csv
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import sqlite3
 import pandas as pd
@@ -13,6 +18,9 @@ import streamlit as st
 # ======================================================================
 
 DB_PATH = "library.db"   # change only if your DB file is named differently
+SEARCH_LIMIT = 200       # max rows a search returns
+PAGE_SIZE = 200          # rows per page on paginated listings (Copies)
+SCHEMA_VERSION = 3       # bump whenever init_db()/ensure_migration() gain new DDL
 
 
 # ======================================================================
@@ -20,13 +28,10 @@ DB_PATH = "library.db"   # change only if your DB file is named differently
 # (safe to run multiple times; they only change what's missing)
 # ======================================================================
 
-def _column_exists(db_path: str, table: str, col: str) -> bool:
-    """Return True if a column exists on a table."""
-    with sqlite3.connect(db_path) as con:
-        cur = con.cursor()
-        cur.execute(f"PRAGMA table_info({table})")
-        cols = [r[1] for r in cur.fetchall()]
-        return col in cols
+def _column_exists(cur: sqlite3.Cursor, table: str, col: str) -> bool:
+    """Return True if a column exists on a table (probed on the caller's cursor)."""
+    cur.execute(f"PRAGMA table_info({table})")
+    return any(r[1] == col for r in cur.fetchall())
 
 
 def ensure_migration():
@@ -37,15 +42,15 @@ def ensure_migration():
     """
     # If the tables don't exist yet, this does nothing harmful; init_db() will
     # run just before in main() and on "Repair".
-    with sqlite3.connect(DB_PATH) as con:
+    with tx() as con:
         cur = con.cursor()
 
         # 1) Add book_id to transactions if missing (older schema might not have it)
-        if _table_exists(cur, "transactions") and not _column_exists(DB_PATH, "transactions", "book_id"):
+        if _table_exists(cur, "transactions") and not _column_exists(cur, "transactions", "book_id"):
             try:
                 cur.execute("ALTER TABLE transactions ADD COLUMN book_id INTEGER")
                 # Backfill from copies.copy_id if present
-                if _column_exists(DB_PATH, "transactions", "copy_id") and _table_exists(cur, "copies"):
+                if _column_exists(cur, "transactions", "copy_id") and _table_exists(cur, "copies"):
                     cur.execute("""
                         UPDATE transactions
                            SET book_id = (
@@ -67,8 +72,6 @@ def ensure_migration():
         except sqlite3.OperationalError:
             pass
 
-        con.commit()
-
 
 def _table_exists(cur: sqlite3.Cursor, name: str) -> bool:
     cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (name,))
@@ -79,109 +82,321 @@ def _table_exists(cur: sqlite3.Cursor, name: str) -> bool:
 #                            DB HELPERS
 # ======================================================================
 
+def _connect(readonly: bool = False) -> sqlite3.Connection:
+    """Open a tuned connection (the writer, or a query_only reader)."""
+    # cached_statements: the prepared-statement cache lives as long as the connection.
+    # isolation_level=None: no implicit BEGINs; tx() opens/closes transactions itself.
+    con = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256,
+                          isolation_level=None)
+    con.execute("PRAGMA busy_timeout = 5000")
+    if readonly:
+        con.execute("PRAGMA query_only = ON")
+    else:
+        con.execute("PRAGMA foreign_keys = ON")
+        # WAL is stored in the DB file; only switch (which needs a lock) if not already on.
+        if con.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+            con.execute("PRAGMA journal_mode = WAL")
+        con.execute("PRAGMA synchronous = NORMAL")
+        con.execute("PRAGMA wal_autocheckpoint = 1000")   # pages; keeps the -wal file bounded
+    con.execute("PRAGMA temp_store = MEMORY")
+    con.execute("PRAGMA cache_size = -64000")
+    con.execute("PRAGMA mmap_size = 268435456")
+    return con
+
+
+@st.cache_resource
 def get_conn():
-    con = sqlite3.connect(DB_PATH, check_same_thread=False)
-    con.execute("PRAGMA foreign_keys = ON")
+    """The single writer connection, shared per process (kept open across reruns)."""
+    con = _connect()
+    atexit.register(optimize_db, con)   # refresh planner stats on shutdown
     return con
 
 
-def fetch_df(sql: str, params: tuple = ()):
-    with get_conn() as con:
+def optimize_db(con: sqlite3.Connection = None):
+    """PRAGMA optimize: re-ANALYZE only the tables whose stats look stale."""
+    con = con or get_conn()
+    with write_lock():
+        try:
+            con.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            pass
+
+
+def checkpoint_db(con: sqlite3.Connection = None):
+    """Fold the WAL back into the main file and truncate it (after bulk writes)."""
+    con = con or get_conn()
+    with write_lock():
+        try:
+            con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error:
+            pass
+
+
+@st.cache_resource
+def write_lock():
+    """Serializes writers on the shared connection (Streamlit runs sessions in threads)."""
+    return threading.RLock()
+
+
+@st.cache_resource
+def _reader_pool():
+    return queue.SimpleQueue()
+
+
+@contextmanager
+def read_conn():
+    """
+    Borrow a read-only connection from the pool (opened on demand, reused after).
+    Under WAL, readers never block - or wait on - the writer.
+    """
+    pool = _reader_pool()
+    try:
+        con = pool.get_nowait()
+    except queue.Empty:
+        con = _connect(readonly=True)
+    try:
+        yield con
+    finally:
+        pool.put(con)
+
+
+def _bind(params):
+    """Hashable bind params: sequences become tuples, named-parameter dicts stay dicts."""
+    return params if isinstance(params, dict) else tuple(params)
+
+
+def _show_plan(sql: str, params: tuple = ()):
+    """Debug mode only: print EXPLAIN QUERY PLAN so full-table scans show up early."""
+    if not st.session_state.get("debug"):
+        return
+    with read_conn() as con:
+        plan = con.execute("EXPLAIN QUERY PLAN " + sql, _bind(params)).fetchall()
+    with st.expander("Query plan"):
+        st.code(sql.strip())
+        st.write([row[-1] for row in plan])
+
+
+def _db_token() -> tuple:
+    """mtimes of the DB and its WAL: changes on any commit, including other processes'."""
+    token = []
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            token.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            token.append(0)
+    return tuple(token)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_df_cached(sql: str, params: tuple, token: tuple):
+    with read_conn() as con:
         return pd.read_sql_query(sql, con, params=params)
 
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_rows_cached(sql: str, params: tuple, token: tuple):
+    with read_conn() as con:
+        return con.execute(sql, params).fetchall()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_one_cached(sql: str, params: tuple, token: tuple):
+    with read_conn() as con:
+        return con.execute(sql, params).fetchone()
+
+
+def fetch_df(sql: str, params: tuple = ()):
+    """Read-only query, memoized on (sql, params, _db_token()); writers also call clear_read_caches()."""
+    _show_plan(sql, params)
+    return _fetch_df_cached(sql, _bind(params), _db_token())
+
+
+def fetch_rows(sql: str, params: tuple = ()):
+    """Like fetch_df but plain tuples, for results fed to dicts/selectboxes."""
+    _show_plan(sql, params)
+    return _fetch_rows_cached(sql, _bind(params), _db_token())
+
+
+def fetch_one(sql: str, params: tuple = ()):
+    """First row as a plain tuple (counts/KPIs), without building a DataFrame."""
+    _show_plan(sql, params)
+    return _fetch_one_cached(sql, _bind(params), _db_token())
+
+
+def clear_read_caches():
+    """Drop every st.cache_data result (fetch_df, search, exports) after a write."""
+    st.cache_data.clear()
+
+
+# tx() nesting depth per thread (the write lock is re-entrant, so depth is per owner)
+_tx_state = threading.local()
+
+
+@contextmanager
+def tx():
+    """One write transaction on the shared connection: commit (or roll back) on exit."""
+    con = get_conn()
+    with write_lock():
+        depth = getattr(_tx_state, "depth", 0)
+        _tx_state.depth = depth + 1
+        try:
+            if depth:
+                # Nested tx(): join the outer transaction, which owns BEGIN/COMMIT
+                yield con
+                return
+            # IMMEDIATE takes SQLite's write lock up front, so a bulk import can't
+            # fail half-way with SQLITE_BUSY when another process is writing
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+                con.execute("COMMIT")
+            except BaseException:
+                # Also covers a failed COMMIT, so the connection never stays mid-transaction
+                if con.in_transaction:
+                    con.execute("ROLLBACK")
+                raise
+        finally:
+            _tx_state.depth = depth
+    clear_read_caches()
+
+
 def exec_sql(sql: str, params: tuple = ()):
-    with get_conn() as con:
-        cur = con.cursor()
-        cur.execute(sql, params)
-        con.commit()
-        return cur.lastrowid
+    with tx() as con:
+        cur = con.execute(sql, params)
+    return cur.lastrowid
 
 
 def exec_many(sql: str, rows):
-    with get_conn() as con:
-        cur = con.cursor()
-        cur.executemany(sql, rows)
-        con.commit()
+    with tx() as con:
+        con.executemany(sql, rows)
 
 
 # ======================================================================
 #                      SCHEMA + GUARDED (RE)CREATION
 # ======================================================================
 
+SCHEMA_SQL = """
+BEGIN;
+
+-- Books
+CREATE TABLE IF NOT EXISTS books(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT,
+    author TEXT,
+    genre TEXT,
+    default_location TEXT,
+    tags TEXT,
+    notes TEXT
+);
+
+-- Copies (kept for import/export/history, but Issue/Return works without copies)
+CREATE TABLE IF NOT EXISTS copies(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id INTEGER,
+    accession_no TEXT,
+    status TEXT DEFAULT 'available',   -- 'available' | 'issued'
+    current_location TEXT,
+    issued_to TEXT,
+    issue_date TEXT,
+    due_date TEXT,
+    FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE
+);
+
+-- Members (simple)
+CREATE TABLE IF NOT EXISTS members(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    phone TEXT,
+    email TEXT
+);
+
+-- Locations (will be healed by migrate_locations)
+CREATE TABLE IF NOT EXISTS locations(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE,
+    description TEXT
+);
+
+-- Transactions (ISSUE/RETURN BY BOOK)
+CREATE TABLE IF NOT EXISTS transactions(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id     INTEGER,
+    member_id   INTEGER,
+    copy_id     INTEGER,                    -- optional (not needed for your flow)
+    issue_date  TEXT DEFAULT (DATE('now')),
+    due_date    TEXT,
+    return_date TEXT,
+    FOREIGN KEY(book_id)   REFERENCES books(id)    ON DELETE CASCADE,
+    FOREIGN KEY(member_id) REFERENCES members(id)  ON DELETE CASCADE
+);
+
+-- Indexes for the predicates the pages actually run
+-- Open loans, already in Issue/Return's display order
+CREATE INDEX IF NOT EXISTS ix_tx_open ON transactions(issue_date) WHERE return_date IS NULL;
+CREATE INDEX IF NOT EXISTS ix_copies_bookid ON copies(book_id);
+CREATE INDEX IF NOT EXISTS ix_books_title ON books(title);
+CREATE INDEX IF NOT EXISTS ix_books_genre ON books(genre);
+CREATE INDEX IF NOT EXISTS ix_members_name ON members(name);
+
+COMMIT;
+"""
+
+
 def init_db():
     """Create tables if they don't exist (safe to run many times)."""
-    with get_conn() as con:
+    con = get_conn()
+    with write_lock():
+        try:
+            # One script: parsed in one pass and committed once
+            con.executescript(SCHEMA_SQL)
+        except sqlite3.Error:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+
+    with tx() as con:
         cur = con.cursor()
 
-        # Books
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS books(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT,
-                author TEXT,
-                genre TEXT,
-                default_location TEXT,
-                tags TEXT,
-                notes TEXT
-            )
-        """)
-
-        # Copies (kept for import/export/history, but Issue/Return works without copies)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS copies(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                book_id INTEGER,
-                accession_no TEXT,
-                status TEXT DEFAULT 'available',   -- 'available' | 'issued'
-                current_location TEXT,
-                issued_to TEXT,
-                issue_date TEXT,
-                due_date TEXT,
-                FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE
-            )
-        """)
-
-        # Members (simple)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS members(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                phone TEXT,
-                email TEXT
-            )
-        """)
-
-        # Locations (will be healed by migrate_locations)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS locations(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE,
-                description TEXT
-            )
-        """)
-
-        # Transactions (ISSUE/RETURN BY BOOK)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS transactions(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                book_id     INTEGER,
-                member_id   INTEGER,
-                copy_id     INTEGER,                    -- optional (not needed for your flow)
-                issue_date  TEXT DEFAULT DATE('now'),
-                due_date    TEXT,
-                return_date TEXT,
-                FOREIGN KEY(book_id)   REFERENCES books(id)    ON DELETE CASCADE,
-                FOREIGN KEY(member_id) REFERENCES members(id)  ON DELETE CASCADE
-            )
-        """)
-
-        con.commit()
+        # Full-text index for Search (trigram = substring matches, like LIKE '%q%')
+        try:
+            fts_is_new = not _table_exists(cur, "books_fts")
+            cur.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+                    title, author, genre,
+                    content='books', content_rowid='id', tokenize='trigram'
+                )
+            """)
+            cur.execute("""
+                CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+                    INSERT INTO books_fts(rowid, title, author, genre)
+                    VALUES (new.id, new.title, new.author, new.genre);
+                END
+            """)
+            cur.execute("""
+                CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+                    INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+                    VALUES ('delete', old.id, old.title, old.author, old.genre);
+                END
+            """)
+            cur.execute("""
+                CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN
+                    INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+                    VALUES ('delete', old.id, old.title, old.author, old.genre);
+                    INSERT INTO books_fts(rowid, title, author, genre)
+                    VALUES (new.id, new.title, new.author, new.genre);
+                END
+            """)
+            if fts_is_new:
+                # Index books that existed before the FTS table did
+                cur.execute("INSERT INTO books_fts(books_fts) VALUES('rebuild')")
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5/trigram: page_search falls back to LIKE
+            pass
 
 
 def migrate_locations():
     """Ensure 'locations' table exists and has the expected columns."""
-    with get_conn() as con:
+    with tx() as con:
         cur = con.cursor()
         cur.execute("""
             CREATE TABLE IF NOT EXISTS locations(
@@ -191,23 +406,48 @@ def migrate_locations():
             )
         """)
         # verify/add column
-        cols = [r[1] for r in cur.execute("PRAGMA table_info(locations)").fetchall()]
-        if "description" not in cols:
+        if not _column_exists(cur, "locations", "description"):
             cur.execute("ALTER TABLE locations ADD COLUMN description TEXT")
-        con.commit()
 
 
+@st.cache_resource
 def ensure_default_locations(n: int = 45):
-    """Insert 'Compartment 1..n' once."""
+    """Insert 'Compartment 1..n' once (cached per process; Repair clears it)."""
     migrate_locations()
-    with get_conn() as con:
-        cur = con.cursor()
-        for i in range(1, n + 1):
-            cur.execute(
-                "INSERT OR IGNORE INTO locations(name, description) VALUES(?, ?)",
-                (f"Compartment {i}", f"Shelf compartment #{i}"),
-            )
-        con.commit()
+    rows = [(f"Compartment {i}", f"Shelf compartment #{i}") for i in range(1, n + 1)]
+    # Read-only check first: skip the write transaction when all n already exist
+    with read_conn() as con:
+        have = con.execute(
+            f"SELECT COUNT(*) FROM locations WHERE name IN ({','.join('?' * n)})",
+            [name for name, _ in rows],
+        ).fetchone()[0]
+    if have < n:
+        exec_many("INSERT OR IGNORE INTO locations(name, description) VALUES(?, ?)", rows)
+    return True
+
+
+@st.cache_resource
+def _schema_ready():
+    """Run init_db + migrations once per process, and only if PRAGMA user_version is behind."""
+    version = get_conn().execute("PRAGMA user_version").fetchone()[0]
+    if version < SCHEMA_VERSION:
+        init_db()   # executescript commits on its own, so it runs first
+        with tx() as con:
+            # Migrations + version stamp commit together (their own tx() calls nest)
+            ensure_migration()
+            migrate_locations()
+            con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            con.execute("ANALYZE")  # planner stats, so the partial open-loan indexes get picked
+    return True
+
+
+@st.cache_resource
+def _bootstrap():
+    """Schema + default compartments, once per process (not on every rerun)."""
+    _schema_ready()
+    ensure_default_locations(45)
+    optimize_db()
+    return True
 
 
 # ======================================================================
@@ -223,19 +463,17 @@ def titled_number(label, value):
 
 
 def selectbox_book(label="Book"):
-    df = fetch_df("SELECT id, title, IFNULL(author, '') AS author FROM books ORDER BY title")
-    if df.empty:
+    rows = fetch_rows("SELECT id, title, IFNULL(author, '') FROM books ORDER BY title")
+    if not rows:
         st.info("No books yet.")
         return None, None
-    options = [f"{row.title} — {row.author}".strip(" —") for _, row in df.iterrows()]
-    choice = st.selectbox(label, options)
-    idx = options.index(choice)
-    return int(df.iloc[idx]["id"]), df.iloc[idx]["title"]
+    options = [f"{t} — {a}".strip(" —") for _, t, a in rows]
+    idx = st.selectbox(label, range(len(rows)), format_func=options.__getitem__)
+    return rows[idx][0], rows[idx][1]
 
 
 def selectbox_location(label="Location", allow_empty=False):
-    df = fetch_df("SELECT name FROM locations ORDER BY id")
-    opts = df["name"].tolist()
+    opts = [name for (name,) in fetch_rows("SELECT name FROM locations ORDER BY id")]
     if allow_empty:
         opts = [""] + opts
     return st.selectbox(label, opts) if opts else ""
@@ -249,70 +487,92 @@ def page_dashboard():
     st.title("KEN Library System")
 
     # KPIs
-    total_books  = fetch_df("SELECT COUNT(*) AS c FROM books")["c"][0]
-    issued_now   = fetch_df("SELECT COUNT(*) AS c FROM transactions WHERE return_date IS NULL")["c"][0]
-    total_issues = fetch_df("SELECT COUNT(*) AS c FROM transactions")["c"][0]
+    total_books, issued_now, total_issues = fetch_one("""
+        SELECT (SELECT COUNT(*) FROM books),
+               (SELECT COUNT(*) FROM transactions WHERE return_date IS NULL),
+               (SELECT COUNT(*) FROM transactions)
+    """)
 
     c1, c2, c3 = st.columns(3)
     c1.metric("Total Books", total_books)
     c2.metric("Issued Now (open)", issued_now)
     c3.metric("Total Issues Ever", total_issues)
 
-    st.subheader("Genres (table)")
-    genre_tbl = fetch_df("""
-        SELECT
-          COALESCE(genre,'(Uncategorized)') AS Genre,
-          COUNT(*) AS Titles,
-          SUM(
-            EXISTS(
-              SELECT 1 FROM transactions t
-              WHERE t.book_id = b.id AND t.return_date IS NULL
-            )
-          ) AS Titles_Issued_Now
-        FROM books b
-        GROUP BY genre
-        ORDER BY Titles DESC, Genre
+    # One book-level query feeds both tables; picking a genre is then an
+    # in-memory filter on the cached frame, with no SQLite round-trip
+    books_df = fetch_df("""
+      WITH open_loans AS (
+        SELECT book_id, COUNT(*) AS cnt FROM transactions
+        WHERE return_date IS NULL GROUP BY book_id
+      )
+      SELECT b.id, b.title AS Title, b.author AS Author,
+             COALESCE(b.genre,'(Uncategorized)') AS Genre,
+             COALESCE(o.cnt, 0) AS Issued_Now
+      FROM books b
+      LEFT JOIN open_loans o ON o.book_id = b.id
+      ORDER BY b.title
     """)
+
+    st.subheader("Genres (table)")
+    genre_tbl = (
+        books_df.assign(Titles_Issued_Now=books_df["Issued_Now"] > 0)
+        .groupby("Genre", as_index=False)
+        .agg(Titles=("id", "size"), Titles_Issued_Now=("Titles_Issued_Now", "sum"))
+        .sort_values(["Titles", "Genre"], ascending=[False, True], ignore_index=True)
+    )
     st.dataframe(genre_tbl, use_container_width=True)
 
     st.markdown("### Pick a genre to see its books")
     genres = ["(All)"] + sorted(genre_tbl["Genre"].unique().tolist())
     pick = st.selectbox("Genre", genres, index=0)
 
-    if pick == "(All)":
-        books_in_genre = fetch_df("""
-          SELECT b.id, b.title AS Title, b.author AS Author,
-                 COALESCE(b.genre,'(Uncategorized)') AS Genre,
-                 (SELECT COUNT(*) FROM transactions t
-                  WHERE t.book_id=b.id AND t.return_date IS NULL) AS Issued_Now
-          FROM books b
-          ORDER BY b.title
-        """)
-    else:
-        books_in_genre = fetch_df("""
-          SELECT b.id, b.title AS Title, b.author AS Author,
-                 COALESCE(b.genre,'(Uncategorized)') AS Genre,
-                 (SELECT COUNT(*) FROM transactions t
-                  WHERE t.book_id=b.id AND t.return_date IS NULL) AS Issued_Now
-          FROM books b
-          WHERE COALESCE(b.genre,'(Uncategorized)') = ?
-          ORDER BY b.title
-        """, (pick,))
+    books_in_genre = books_df if pick == "(All)" else books_df[books_df["Genre"] == pick]
 
     st.dataframe(books_in_genre, use_container_width=True)
 
 
+def _search_books(q: str) -> pd.DataFrame:
+    """Books matching q, read through fetch_df (cached per query, plan in debug mode)."""
+    with read_conn() as con:
+        has_fts = _table_exists(con.cursor(), "books_fts")
+    if has_fts:
+        phrase = '"' + q.replace('"', '""') + '"'
+        return fetch_df("""
+            SELECT b.id, b.title, b.author, b.genre, b.default_location
+            FROM books_fts f
+            JOIN books b ON b.id = f.rowid
+            WHERE books_fts MATCH ?
+            ORDER BY f.rank, b.title
+            LIMIT ?
+        """, (phrase, SEARCH_LIMIT))
+    # SQLite without FTS5: plain substring scan
+    return fetch_df("""
+        SELECT id, title, author, genre, default_location
+        FROM books
+        WHERE title LIKE :q OR author LIKE :q OR genre LIKE :q
+        ORDER BY title
+        LIMIT :lim
+    """, {"q": f"%{q}%", "lim": SEARCH_LIMIT})
+
+
+@st.fragment
+def _search_fragment():
+    """Form + results only: submitting a search reruns this block, not the whole page."""
+    # A form only reruns on submit, not on every keystroke
+    with st.form("search"):
+        q = st.text_input("Type a keyword (title/author/genre)").strip()
+        submitted = st.form_submit_button("Search")
+    if not (submitted and q):
+        return
+    if len(q) < 3:
+        st.caption("Type at least 3 characters.")
+    else:
+        st.dataframe(_search_books(q), use_container_width=True)
+
+
 def page_search():
     st.title("🔎 Search")
-    q = st.text_input("Type a keyword (title/author/genre)")
-    if q:
-        df = fetch_df("""
-            SELECT id, title, author, genre, default_location
-            FROM books
-            WHERE title LIKE ? OR author LIKE ? OR genre LIKE ?
-            ORDER BY title
-        """, (f"%{q}%", f"%{q}%", f"%{q}%"))
-        st.dataframe(df, use_container_width=True)
+    _search_fragment()
 
 
 def page_books():
@@ -348,22 +608,37 @@ def page_copies():
             st.success(f"Copy added for: {book_title}")
             st.rerun()
 
+    # Paginated: only one page of rows goes through pandas and to the browser
+    total = fetch_one("SELECT COUNT(*) FROM copies c JOIN books b ON b.id = c.book_id")[0]
+    pages = max(1, -(-total // PAGE_SIZE))
+    page = int(st.number_input("Page", min_value=1, max_value=pages, value=1, step=1)) if pages > 1 else 1
     df = fetch_df("""
         SELECT c.id, b.title, b.author, c.accession_no, c.status, c.current_location,
                c.issued_to, c.issue_date, c.due_date
         FROM copies c
         JOIN books b ON b.id = c.book_id
-        ORDER BY b.title
-    """)
+        ORDER BY b.title, c.id
+        LIMIT ? OFFSET ?
+    """, (PAGE_SIZE, (page - 1) * PAGE_SIZE))
+    st.caption(f"{total} copies · page {page} of {pages}")
     st.dataframe(df, use_container_width=True)
 
 
-def run_sql(sql, params=()):
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(sql, params)
-        conn.commit()
-        return cur.lastrowid
+@st.fragment
+def _issue_fragment(book_titles: dict, member_names: dict):
+    """Issue pickers rerun on their own; only a successful issue reruns the page."""
+    book_id = st.selectbox("Book title", list(book_titles), format_func=book_titles.get)
+    member_id = st.selectbox("Member", list(member_names), format_func=member_names.get)
+
+    due_date = st.date_input("Due date (optional)", value=None)
+
+    if st.button("Issue"):
+        exec_sql(
+            "INSERT INTO transactions(book_id, member_id, issue_date, due_date) VALUES (?, ?, DATE('now'), ?)",
+            (book_id, member_id, str(due_date) if due_date else None)
+        )
+        st.toast(f"Issued **{book_titles[book_id]}** to **{member_names[member_id]}**")
+        st.rerun()  # refresh the open-issues table outside this fragment
 
 
 def page_issue_return():
@@ -371,30 +646,17 @@ def page_issue_return():
 
     # --- Issue a book (no copies) ---
     st.subheader("Issue a Book")
-    books = fetch_df("SELECT id, title FROM books ORDER BY title")
-    if books.empty:
+    books = fetch_rows("SELECT id, title FROM books ORDER BY title")
+    if not books:
         st.info("No books yet. Please add books on the Books page.")
         return
-    book_label_to_id = dict(zip(books["title"], books["id"]))
-    book_label = st.selectbox("Book title", books["title"])
+    book_titles = dict(books)
 
-    members = fetch_df("SELECT id, name FROM members ORDER BY name")
-    if members.empty:
+    members = fetch_rows("SELECT id, name FROM members ORDER BY name")
+    if not members:
         st.info("No members yet. Please add members on the Members page.")
         return
-    member_label_to_id = dict(zip(members["name"], members["id"]))
-    member_label = st.selectbox("Member", members["name"])
-
-    due_date = st.date_input("Due date (optional)", value=None)
-
-    if st.button("Issue"):
-        book_id = book_label_to_id[book_label]
-        member_id = member_label_to_id[member_label]
-        run_sql(
-            "INSERT INTO transactions(book_id, member_id, issue_date, due_date) VALUES (?, ?, DATE('now'), ?)",
-            (book_id, member_id, str(due_date) if due_date else None)
-        )
-        st.success(f"Issued **{book_label}** to **{member_label}**")
+    _issue_fragment(book_titles, dict(members))
 
     st.divider()
 
@@ -416,10 +678,20 @@ def page_issue_return():
 
     # Return one row
     if not open_df.empty:
-        ret_id = st.selectbox("Pick a transaction to return", open_df["Txn_ID"].tolist())
+        open_labels = dict(zip(open_df["Txn_ID"], open_df["Title"] + " — " + open_df["Member"]))
+        ret_id = st.selectbox("Pick a transaction to return", list(open_labels),
+                              format_func=lambda i: f"#{i} · {open_labels[i]}")
         if st.button("Mark returned"):
-            run_sql("UPDATE transactions SET return_date = DATE('now') WHERE id = ?", (int(ret_id),))
-            st.success("Marked as returned ✅")
+            # One statement: only closes a still-open row, and tells us whether it did
+            with tx() as conn:
+                closed = conn.execute("""
+                    UPDATE transactions SET return_date = DATE('now')
+                     WHERE id = ? AND return_date IS NULL
+                """, (int(ret_id),)).rowcount
+            if closed:
+                st.success("Marked as returned ✅")
+            else:
+                st.warning("That transaction was already returned.")
 
     st.divider()
 
@@ -451,8 +723,47 @@ def page_locations():
             st.success("Location added.")
             st.rerun()
 
-    df = fetch_df("SELECT id, name, description FROM locations ORDER BY id")
-    st.dataframe(df, use_container_width=True)
+    st.dataframe(fetch_df("SELECT id, name, description FROM locations ORDER BY id"),
+                 use_container_width=True)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _export_csv_bytes(sql: str, token: tuple) -> bytes:
+    """CSV of a query written straight from the cursor (no DataFrame); token = _db_token()."""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    with read_conn() as con:
+        cur = con.execute(sql)
+        w.writerow([d[0] for d in cur.description])
+        w.writerows(cur)
+    return buf.getvalue().encode("utf-8")
+
+
+def _stage_csv(cur: sqlite3.Cursor, up, src_cols, use_arrow: bool = True) -> int:
+    """
+    Stream an uploaded CSV into temp.books_stage, whitespace-stripped, in batches.
+    src_cols are the file's own header names for title/author/genre/default_location.
+    use_arrow=True streams batches from pyarrow's (single-threaded) CSV reader; False uses pandas chunks.
+    Returns the number of rows staged.
+    """
+    sql = "INSERT INTO books_stage VALUES(?, ?, ?, ?)"
+    staged = 0
+    if use_arrow:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.csv as pacsv
+        reader = pacsv.open_csv(up, convert_options=pacsv.ConvertOptions(
+            column_types={c: pa.string() for c in src_cols}, include_columns=src_cols))
+        for batch in reader:
+            cols = [pc.utf8_trim_whitespace(batch.column(c)).to_pylist() for c in src_cols]
+            cur.executemany(sql, zip(*cols))
+            staged += batch.num_rows
+    else:
+        for chunk in pd.read_csv(up, chunksize=5000, dtype=str, keep_default_na=False):
+            chunk = chunk[src_cols].apply(lambda s: s.str.strip())
+            cur.executemany(sql, chunk.itertuples(index=False, name=None))
+            staged += len(chunk)
+    return staged
 
 
 def page_import_export():
@@ -463,56 +774,67 @@ def page_import_export():
         init_db()
         ensure_migration()
         migrate_locations()
+        ensure_default_locations.clear()
         ensure_default_locations(45)
+        clear_read_caches()
         st.success("Repair done.")
 
     st.subheader("Import Books (CSV)")
     st.caption("Expected columns: title, author, genre, default_location (others ignored)")
     up = st.file_uploader("Upload CSV", type=["csv"])
     if up is not None:
-        df = pd.read_csv(up)
-        needed = {"title", "author", "genre", "default_location"}
-        if not needed.issubset(set(c.lower() for c in df.columns)):
+        header = pd.read_csv(up, nrows=0)
+        cols_map = {c: c.lower() for c in header.columns}
+        cols = ["title", "author", "genre", "default_location"]
+        if not set(cols).issubset(cols_map.values()):
             st.error("CSV missing required columns.")
         else:
-            # Normalize columns
-            cols_map = {c: c.lower() for c in df.columns}
-            df.rename(columns=cols_map, inplace=True)
-            rows = []
-            for _, r in df.iterrows():
-                rows.append((
-                    str(r.get("title","")).strip(),
-                    str(r.get("author","")).strip(),
-                    str(r.get("genre","")).strip(),
-                    str(r.get("default_location","")).strip()
-                ))
-            # insert (simple upsert on title+author)
-            with get_conn() as con:
+            up.seek(0)
+            # Stream the file in chunks into a temp staging table, then move it
+            # into books with one INSERT ... SELECT (simple upsert on title+author)
+            src_cols = [{low: c for c, low in cols_map.items()}[c] for c in cols]
+            with tx() as con:
                 cur = con.cursor()
                 cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_books_title_author ON books(title, author)")
-                cur.executemany("""
+                cur.execute("DROP TABLE IF EXISTS temp.books_stage")
+                cur.execute("CREATE TEMP TABLE books_stage(title, author, genre, default_location)")
+                try:
+                    staged = _stage_csv(cur, up, src_cols, use_arrow=True)
+                except (ImportError, ValueError, KeyError):
+                    # No pyarrow, or a file its parser rejects: redo it with pandas
+                    cur.execute("DELETE FROM books_stage")
+                    up.seek(0)
+                    staged = _stage_csv(cur, up, src_cols, use_arrow=False)
+                cur.execute("""
                     INSERT OR IGNORE INTO books(title, author, genre, default_location)
-                    VALUES(?, ?, ?, ?)
-                """, rows)
-                con.commit()
-            st.success(f"Imported {len(rows)} rows (existing titles skipped).")
+                    SELECT title, author, genre, default_location
+                      FROM books_stage
+                     WHERE title <> ''
+                """)
+                added = cur.rowcount
+                cur.execute("DROP TABLE books_stage")
+                if added:
+                    cur.execute("ANALYZE books")   # fresh stats for the new titles
+            if added:
+                # The import can leave thousands of WAL pages that every reader would walk
+                checkpoint_db()
+                optimize_db()
+            st.success(f"Imported {added} of {staged} rows (existing titles skipped).")
 
     st.subheader("Export (CSV)")
+    token = _db_token()   # cache key: exports rebuild after any commit, ours or not
     c1, c2, c3 = st.columns(3)
     with c1:
         if st.button("Export Books"):
-            df = fetch_df("SELECT * FROM books ORDER BY title")
-            st.download_button("Download books.csv", df.to_csv(index=False).encode("utf-8"),
+            st.download_button("Download books.csv", _export_csv_bytes("SELECT * FROM books ORDER BY title", token),
                                "books.csv", "text/csv")
     with c2:
         if st.button("Export Copies"):
-            df = fetch_df("SELECT * FROM copies ORDER BY id")
-            st.download_button("Download copies.csv", df.to_csv(index=False).encode("utf-8"),
+            st.download_button("Download copies.csv", _export_csv_bytes("SELECT * FROM copies ORDER BY id", token),
                                "copies.csv", "text/csv")
     with c3:
         if st.button("Export Locations"):
-            df = fetch_df("SELECT * FROM locations ORDER BY id")
-            st.download_button("Download locations.csv", df.to_csv(index=False).encode("utf-8"),
+            st.download_button("Download locations.csv", _export_csv_bytes("SELECT * FROM locations ORDER BY id", token),
                                "locations.csv", "text/csv")
 
 
@@ -523,11 +845,8 @@ def page_import_export():
 def main():
     st.set_page_config(page_title="KEN Library", page_icon="📚", layout="wide")
 
-    # Make sure DB & schema are good every time the app starts
-    init_db()
-    ensure_migration()
-    migrate_locations()
-    ensure_default_locations(45)
+    # Make sure DB & schema are good (once per process)
+    _bootstrap()
 
     PAGES = {
         "Dashboard":      page_dashboard,
@@ -541,6 +860,7 @@ def main():
 
     with st.sidebar:
         choice = st.radio("Go to", list(PAGES.keys()), index=0)
+        st.toggle("Show query plans", key="debug")
 
     PAGES[choice]()
 